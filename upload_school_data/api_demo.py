@@ -1,70 +1,148 @@
 import openai
-import pymysql
 import json
 import uuid
+import hashlib
+from collections import OrderedDict
 from dotenv import load_dotenv
 import os
 from typing import List, Dict
+from vector_store import get_vector_store
 
 # 加载环境变量
 load_dotenv('../.env')
 
 # 配置
 client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+EMBEDDING_MODEL = "text-embedding-ada-002"
 
-def get_db_connection():
-    return pymysql.connect(
-        host=os.getenv('TIDB_HOST'),
-        port=int(os.getenv('TIDB_PORT', 4000)),
-        user=os.getenv('TIDB_USER'),
-        password=os.getenv('TIDB_PASSWORD'),
-        database=os.getenv('TIDB_DATABASE'),
-        charset='utf8mb4',
-        ssl={'check_hostname': False, 'verify_mode': 0}
-    )
+# 用户档案向量的合成方式: recency(按时间衰减加权平均) / mean(平均) / full(整段档案重新向量化)
+PROFILE_EMBEDDING_STRATEGIES = ('recency', 'mean', 'full')
+PROFILE_EMBEDDING_STRATEGY = os.getenv('PROFILE_EMBEDDING_STRATEGY', 'recency')
+PROFILE_RECENCY_DECAY = float(os.getenv('PROFILE_RECENCY_DECAY', 0.8))
+# full 策略每轮都会为整段档案付费，仅在档案较短时使用，超出则回退到 recency
+PROFILE_FULL_MAX_CHARS = int(os.getenv('PROFILE_FULL_MAX_CHARS', 2000))
+
+# 消息级向量缓存 (LRU): sha256(模型+文本) -> 向量，同一条消息只向量化一次
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', 1000))
+_embedding_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+
+def _cache_key(text: str) -> str:
+    return hashlib.sha256(f"{EMBEDDING_MODEL}\n{text}".encode('utf-8')).hexdigest()
+
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    """
+    批量向量化文本，已缓存的文本不再请求API
+    新的一轮对话只需为新增消息付费
+    """
+    vectors = {}
+    missing = []
+    for text in dict.fromkeys(texts):
+        key = _cache_key(text)
+        if key in _embedding_cache:
+            _embedding_cache.move_to_end(key)
+            vectors[text] = _embedding_cache[key]
+        else:
+            missing.append(text)
+    
+    if missing:
+        print(f"🔄 向量化 {len(missing)} 条新消息 (缓存命中 {len(vectors)} 条)...")
+        response = client.embeddings.create(
+            input=missing,
+            model=EMBEDDING_MODEL
+        )
+        for item in response.data:
+            text = missing[item.index]
+            vectors[text] = item.embedding
+            _embedding_cache[_cache_key(text)] = item.embedding
+        
+        # 超出容量时淘汰最久未使用的条目
+        while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+            _embedding_cache.popitem(last=False)
+    
+    return [vectors[text] for text in texts]
+
+def combine_embeddings(vectors: List[List[float]], weights: List[float]) -> List[float]:
+    """加权平均多个向量，并归一化为单位向量"""
+    total = sum(weights)
+    combined = [0.0] * len(vectors[0])
+    for vector, weight in zip(vectors, weights):
+        w = weight / total
+        for i, value in enumerate(vector):
+            combined[i] += w * value
+    
+    norm = sum(value * value for value in combined) ** 0.5
+    if norm == 0:
+        return combined
+    return [value / norm for value in combined]
+
+def build_profile_embedding(user_messages: List[str], strategy: str = None) -> List[float]:
+    """
+    将用户消息合成为单个档案向量
+    
+    Args:
+        user_messages: 按时间顺序排列的用户消息
+        strategy: recency / mean / full，默认读取 PROFILE_EMBEDDING_STRATEGY
+    
+    Returns:
+        档案向量
+    """
+    strategy = strategy or PROFILE_EMBEDDING_STRATEGY
+    # 在调用付费API之前校验策略
+    if strategy not in PROFILE_EMBEDDING_STRATEGIES:
+        raise ValueError(f"Unknown profile embedding strategy: {strategy}")
+    
+    if strategy == 'full':
+        user_profile = ' '.join(user_messages)
+        if len(user_profile) <= PROFILE_FULL_MAX_CHARS:
+            # 整段档案作为一条文本，同样走缓存，内容不变时不重复计费
+            return embed_texts([user_profile])[0]
+        print(f"⚠️ 档案长度 {len(user_profile)} 超过 {PROFILE_FULL_MAX_CHARS}，改用 recency 合成")
+        strategy = 'recency'
+    
+    vectors = embed_texts(user_messages)
+    if strategy == 'mean':
+        weights = [1.0] * len(vectors)
+    else:
+        # recency: 越新的消息权重越高: decay^(n-1-i)
+        n = len(vectors)
+        weights = [PROFILE_RECENCY_DECAY ** (n - 1 - i) for i in range(n)]
+    
+    return combine_embeddings(vectors, weights)
 
-def analyze_chat(chat_history: List[Dict]) -> Dict:
+def analyze_chat(chat_history: List[Dict], strategy: str = None) -> Dict:
     """
     分析聊天记录，提取用户信息并返回analysis_id
     对应前端: analyzeChat(chatHistory)
+    
+    每条用户消息单独向量化并缓存，再按 strategy 合成档案向量
     """
     print("🔄 分析聊天记录...")
     
     # 生成session_id
     session_id = str(uuid.uuid4())
     
-    # 提取用户信息
-    user_messages = [msg['content'] for msg in chat_history if msg['role'] == 'user']
+    # 提取用户信息 (忽略空白消息，embeddings API 会拒绝空输入)
+    user_messages = [
+        msg['content'].strip() for msg in chat_history
+        if msg['role'] == 'user' and msg['content'] and msg['content'].strip()
+    ]
+    if not user_messages:
+        raise Exception("No user messages to analyze")
     user_profile = ' '.join(user_messages)
     
     print("🔄 向量化用户档案...")
-    # 向量化用户档案
-    response = client.embeddings.create(
-        input=user_profile,
-        model="text-embedding-ada-002"
-    )
-    profile_vector = response.data[0].embedding
+    # 向量化用户档案 (消息级缓存，只为新消息计费)
+    profile_vector = build_profile_embedding(user_messages, strategy)
     
     # 存储到数据库
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO user_sessions (
-                    session_id, chat_messages, user_profile, 
-                    profile_embedding, status
-                ) VALUES (%s, %s, %s, %s, %s)
-            """, (
-                session_id,
-                json.dumps(chat_history),
-                user_profile,
-                str(profile_vector),
-                'analyzed'
-            ))
-        conn.commit()
-        print(f"✅ 用户会话创建成功: {session_id}")
-    finally:
-        conn.close()
+    get_vector_store().create_session(
+        session_id,
+        json.dumps(chat_history),
+        user_profile,
+        profile_vector,
+        'analyzed'
+    )
+    print(f"✅ 用户会话创建成功: {session_id}")
     
     return {
         "analysis_id": session_id,
@@ -79,96 +157,62 @@ def get_schools(analysis_id: str) -> Dict:
     """
     print(f"🔄 获取学校匹配结果: {analysis_id}")
     
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            # 获取用户档案向量
-            cursor.execute("""
-                SELECT profile_embedding FROM user_sessions 
-                WHERE session_id = %s
-            """, (analysis_id,))
-            
-            result = cursor.fetchone()
-            if not result:
-                raise Exception("Session not found")
-            
-            user_vector = result[0]
-            
-            print("🔄 执行向量搜索...")
-            # 搜索target schools (相似度高的)
-            cursor.execute("""
-                SELECT 
-                    id, school_name, program_name, country_region,
-                    qs_ranking, degree_type, duration, program_details,
-                    VEC_COSINE_DISTANCE(embedding, %s) AS similarity
-                FROM schools 
-                ORDER BY similarity ASC 
-                LIMIT 3
-            """, (user_vector,))
-            
-            target_results = cursor.fetchall()
-            target_schools = []
-            for row in target_results:
-                target_schools.append({
-                    "school": row[1],
-                    "program": row[2],
-                    "match_score": int((1 - row[8]) * 100),  # 转换为匹配分数
-                    "deadline": "2025-01-15",  # 示例数据
-                    "requirements": "Basic background sufficient",
-                    "tuition": "$43,000",
-                    "employment_rate": "92%",
-                    "reason": f"Great match for your background in {row[3]}"
-                })
-            
-            # 搜索reach schools (相似度中等，但排名更高的)
-            cursor.execute("""
-                SELECT 
-                    id, school_name, program_name, country_region,
-                    qs_ranking, degree_type, duration, program_details,
-                    VEC_COSINE_DISTANCE(embedding, %s) AS similarity
-                FROM schools 
-                WHERE qs_ranking <= 20
-                ORDER BY similarity ASC 
-                LIMIT 2
-            """, (user_vector,))
-            
-            reach_results = cursor.fetchall()
-            reach_schools = []
-            for row in reach_results:
-                reach_schools.append({
-                    "school": row[1],
-                    "program": row[2], 
-                    "match_score": max(50, int((1 - row[8]) * 100) - 20),  # 降低分数
-                    "gaps": ["Advanced Math", "Research Experience"],
-                    "suggestions": "Complete prerequisite courses and gain research experience",
-                    "deadline": "2025-12-01",
-                    "tuition": "$77,000",
-                    "requirements": "Strong academic background required",
-                    "employment_rate": "98%",
-                    "reason": f"Top-tier program at {row[1]}"
-                })
-            
-            # 更新数据库
-            schools_data = {
-                "target_schools": target_schools,
-                "reach_schools": reach_schools
-            }
-            
-            cursor.execute("""
-                UPDATE user_sessions 
-                SET target_schools = %s, reach_schools = %s
-                WHERE session_id = %s
-            """, (
-                json.dumps(target_schools),
-                json.dumps(reach_schools), 
-                analysis_id
-            ))
-            
-        conn.commit()
-        print(f"✅ 找到 {len(target_schools)} 个目标学校，{len(reach_schools)} 个冲刺学校")
-        
-    finally:
-        conn.close()
+    store = get_vector_store()
+    
+    # 获取用户档案向量
+    user_vector = store.get_profile_embedding(analysis_id)
+    if user_vector is None:
+        raise Exception("Session not found")
+    
+    print("🔄 执行向量搜索...")
+    # 搜索target schools (相似度高的)
+    target_results = store.search_schools(user_vector, top_k=3)
+    # 搜索reach schools (相似度中等，但排名更高的)
+    reach_results = store.search_schools(user_vector, top_k=2, ranking_limit=20)
+    
+    # 只为最终结果批量获取展示字段，一次查询覆盖两组结果，之后 hydrate 直接命中缓存
+    store.get_school_metadata([row['id'] for row in target_results + reach_results])
+    
+    target_schools = []
+    for row in store.hydrate_schools(target_results):
+        target_schools.append({
+            "school": row['school_name'],
+            "program": row['program_name'],
+            "match_score": int((1 - row['distance']) * 100),  # 转换为匹配分数
+            "deadline": "2025-01-15",  # 示例数据
+            "requirements": "Basic background sufficient",
+            "tuition": "$43,000",
+            "employment_rate": "92%",
+            "reason": f"Great match for your background in {row['country_region']}"
+        })
+    
+    reach_schools = []
+    for row in store.hydrate_schools(reach_results):
+        reach_schools.append({
+            "school": row['school_name'],
+            "program": row['program_name'], 
+            "match_score": max(50, int((1 - row['distance']) * 100) - 20),  # 降低分数
+            "gaps": ["Advanced Math", "Research Experience"],
+            "suggestions": "Complete prerequisite courses and gain research experience",
+            "deadline": "2025-12-01",
+            "tuition": "$77,000",
+            "requirements": "Strong academic background required",
+            "employment_rate": "98%",
+            "reason": f"Top-tier program at {row['school_name']}"
+        })
+    
+    # 更新数据库
+    schools_data = {
+        "target_schools": target_schools,
+        "reach_schools": reach_schools
+    }
+    
+    store.update_session(
+        analysis_id,
+        target_schools=json.dumps(target_schools),
+        reach_schools=json.dumps(reach_schools)
+    )
+    print(f"✅ 找到 {len(target_schools)} 个目标学校，{len(reach_schools)} 个冲刺学校")
     
     return schools_data
 
@@ -223,18 +267,12 @@ def get_timeline(analysis_id: str) -> Dict:
     }
     
     # 更新数据库
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                UPDATE user_sessions 
-                SET timeline_data = %s, status = 'completed'
-                WHERE session_id = %s
-            """, (json.dumps(timeline_data), analysis_id))
-        conn.commit()
-        print("✅ 时间线生成完成")
-    finally:
-        conn.close()
+    get_vector_store().update_session(
+        analysis_id,
+        timeline_data=json.dumps(timeline_data),
+        status='completed'
+    )
+    print("✅ 时间线生成完成")
     
     return timeline_data
 
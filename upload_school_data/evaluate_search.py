@@ -0,0 +1,400 @@
+import argparse
+import csv
+import hashlib
+import os
+import time
+from typing import List, Dict, Callable, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv('../.env')
+
+# 合成数据使用的国家/地区
+SYNTHETIC_COUNTRIES = ['United States', 'United Kingdom', 'Australia', 'Canada', 'Singapore', 'Hong Kong SAR']
+
+DEFAULT_CONFIGS = [
+    'exact', 'float16', 'int8',
+    'truncate:512', 'truncate:256', 'project:256', 'project:128',
+    'ivf:auto:1', 'ivf:auto:4', 'ivf:auto:8'
+]
+DEFAULT_FILTERS = ['none', 'ranking<=20']
+
+
+# 从向量存储加载真实目录向量
+def load_catalog() -> Tuple[np.ndarray, List[Dict]]:
+    """返回 (向量矩阵, 每行的元数据)"""
+    from vector_store import get_vector_store
+
+    print("🔄 从向量存储加载目录向量...")
+    rows = get_vector_store().load_catalog_embeddings()
+    if not rows:
+        raise Exception("Catalog is empty")
+
+    data = np.asarray([row['embedding'] for row in rows], dtype=np.float32)
+    metadata = [{'id': row['id'], 'country_region': row['country_region'], 'qs_ranking': row['qs_ranking']} for row in rows]
+    print(f"✅ 加载了 {len(rows)} 个项目，维度: {data.shape[1]}")
+    return data, metadata
+
+
+# 生成合成目录向量 (带聚类结构，接近真实文本向量的分布)
+def load_synthetic(size: int, dim: int, seed: int) -> Tuple[np.ndarray, List[Dict]]:
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, size // 50)
+    centers = rng.normal(size=(n_clusters, dim))
+    labels = rng.integers(0, n_clusters, size=size)
+    data = centers[labels] + 0.5 * rng.normal(size=(size, dim))
+
+    metadata = [
+        {
+            'id': i,
+            'country_region': SYNTHETIC_COUNTRIES[int(rng.integers(len(SYNTHETIC_COUNTRIES)))],
+            'qs_ranking': int(rng.integers(1, 101))
+        }
+        for i in range(size)
+    ]
+    print(f"✅ 生成了 {size} 个合成项目，维度: {dim}")
+    return data.astype(np.float32), metadata
+
+
+# 生成查询: 对目录中随机项目加噪声，模拟与某些项目相近的学生档案
+def make_queries(data: np.ndarray, n_queries: int, noise: float, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed + 1)
+    picks = rng.integers(0, len(data), size=n_queries)
+    base = data[picks]
+    scale = np.linalg.norm(base, axis=1, keepdims=True) / np.sqrt(data.shape[1])
+    return (base + noise * scale * rng.normal(size=base.shape)).astype(np.float32)
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    """按行归一化，零向量保持为零 (与 match_schools.cosine_similarity 返回0一致)"""
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms != 0)
+
+
+def top_k(scores: np.ndarray, k: int, candidates: np.ndarray = None) -> np.ndarray:
+    """返回得分最高的k个下标 (降序)，candidates 为得分对应的原始下标"""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    part = np.argpartition(-scores, k - 1)[:k]
+    order = part[np.argsort(-scores[part], kind='stable')]
+    return order if candidates is None else candidates[order]
+
+
+def masked_top_k(index: np.ndarray, query: np.ndarray, k: int, mask: Optional[np.ndarray]) -> np.ndarray:
+    """只在过滤掩码允许的行中取 top-k，满足条件的行不足k个时返回的下标也少于k个"""
+    if mask is None:
+        return top_k(index @ query, k)
+    allowed = np.flatnonzero(mask)
+    return top_k(index[allowed] @ query, k, allowed)
+
+
+def parse_filter(spec: str, metadata: List[Dict]) -> Optional[np.ndarray]:
+    """
+    解析过滤条件为布尔掩码
+    支持: none / ranking<=N / country=NAME
+    """
+    if spec == 'none':
+        return None
+    if spec.startswith('ranking<='):
+        limit = int(spec.split('<=', 1)[1])
+        return np.array([m['qs_ranking'] is not None and m['qs_ranking'] <= limit for m in metadata])
+    if spec.startswith('country='):
+        country = spec.split('=', 1)[1]
+        return np.array([m['country_region'] == country for m in metadata])
+    raise ValueError(f"Unknown filter: {spec}")
+
+
+def _cache_path(cache_dir: str, data: np.ndarray, queries: np.ndarray, k: int, mask: Optional[np.ndarray]) -> str:
+    # 直接哈希过滤掩码: 元数据 (排名/国家) 变化而向量不变时，缓存也会失效
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(data).tobytes())
+    digest.update(np.ascontiguousarray(queries).tobytes())
+    digest.update(str(k).encode('utf-8'))
+    digest.update(b'none' if mask is None else np.packbits(mask).tobytes())
+    return os.path.join(cache_dir, f"ground_truth_{digest.hexdigest()[:16]}.npy")
+
+
+# 精确 top-k，结果缓存到磁盘，数据/查询/k/过滤掩码不变时直接复用
+def exact_ground_truth(data_unit: np.ndarray, queries_unit: np.ndarray, k: int, mask: Optional[np.ndarray],
+                       filter_spec: str, cache_dir: str) -> np.ndarray:
+    """
+    Args:
+        data_unit / queries_unit: 已归一化的 float64 目录向量与查询向量
+
+    Returns:
+        每个查询的精确 top-k 下标，过滤后不足k个时以 -1 补齐
+        只缓存下标，评估时需要的精确相似度按需重新计算
+    """
+    path = _cache_path(cache_dir, data_unit, queries_unit, k, mask)
+    if os.path.exists(path):
+        print(f"✅ 使用缓存的精确结果: {path}")
+        return np.load(path)
+
+    print(f"🔄 计算精确 top-{k} ({filter_spec})...")
+    allowed = np.arange(len(data_unit)) if mask is None else np.flatnonzero(mask)
+    candidates = data_unit[allowed]
+
+    indices = np.full((len(queries_unit), k), -1, dtype=np.int64)
+    for i, query in enumerate(queries_unit):
+        best = top_k(candidates @ query, k, allowed)
+        indices[i, :len(best)] = best
+
+    os.makedirs(cache_dir, exist_ok=True)
+    np.save(path, indices)
+    return indices
+
+
+# 待评估的检索配置
+# 每个配置 build(data) 返回 (search(query, k, mask) -> 下标, 存储字节数)
+# 量化配置在 build 阶段一次性反量化，反量化耗时计入 build_ms；
+# 存储字节数按量化后的大小计算
+def build_exact(data: np.ndarray):
+    index = normalize(data)
+
+    def search(query, k, mask):
+        return masked_top_k(index, normalize(query), k, mask)
+
+    return search, index.nbytes
+
+
+def build_float16(data: np.ndarray):
+    stored = normalize(data).astype(np.float16)
+    index = stored.astype(np.float32)
+
+    def search(query, k, mask):
+        return masked_top_k(index, normalize(query), k, mask)
+
+    return search, stored.nbytes
+
+
+def build_int8(data: np.ndarray):
+    # 按维度对称标量量化
+    unit = normalize(data)
+    scale = np.abs(unit).max(axis=0) / 127
+    scale[scale == 0] = 1
+    codes = np.round(unit / scale).astype(np.int8)
+    index = (codes * scale).astype(np.float32)
+
+    def search(query, k, mask):
+        return masked_top_k(index, normalize(query), k, mask)
+
+    return search, codes.nbytes + scale.nbytes
+
+
+def build_truncate(data: np.ndarray, dims: int):
+    index = normalize(data[:, :dims])
+
+    def search(query, k, mask):
+        return masked_top_k(index, normalize(query[:dims]), k, mask)
+
+    return search, index.nbytes
+
+
+def build_project(data: np.ndarray, dims: int, seed: int = 0):
+    # 高斯随机投影降维
+    rng = np.random.default_rng(seed)
+    projection = (rng.normal(size=(data.shape[1], dims)) / np.sqrt(dims)).astype(np.float32)
+    index = normalize(normalize(data) @ projection)
+
+    def search(query, k, mask):
+        return masked_top_k(index, normalize(normalize(query) @ projection), k, mask)
+
+    return search, index.nbytes + projection.nbytes
+
+
+def build_ivf(data: np.ndarray, nlist: int, nprobe: int, iterations: int = 10, seed: int = 0):
+    # 倒排文件索引: 球面 k-means 粗聚类，查询时只扫描最近的 nprobe 个簇
+    unit = normalize(data)
+    nlist = min(nlist, len(unit))
+    rng = np.random.default_rng(seed)
+    centroids = unit[rng.choice(len(unit), size=nlist, replace=False)]
+
+    for _ in range(iterations):
+        assignment = np.argmax(unit @ centroids.T, axis=1)
+        for c in range(nlist):
+            members = unit[assignment == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+        centroids = normalize(centroids)
+
+    assignment = np.argmax(unit @ centroids.T, axis=1)
+    lists = [np.flatnonzero(assignment == c) for c in range(nlist)]
+
+    def search(query, k, mask):
+        q = normalize(query)
+        probes = top_k(centroids @ q, nprobe)
+        candidates = np.concatenate([lists[c] for c in probes])
+        if mask is not None:
+            candidates = candidates[mask[candidates]]
+        return top_k(unit[candidates] @ q, k, candidates)
+
+    return search, unit.nbytes + centroids.nbytes
+
+
+def parse_config(spec: str, data: np.ndarray) -> Tuple[str, Callable]:
+    """
+    解析配置字符串
+    支持: exact / float16 / int8 / truncate:D / project:D / ivf:NLIST:NPROBE (NLIST 可为 auto)
+    """
+    parts = spec.split(':')
+    name = parts[0]
+    if name == 'exact':
+        return spec, lambda: build_exact(data)
+    if name == 'float16':
+        return spec, lambda: build_float16(data)
+    if name == 'int8':
+        return spec, lambda: build_int8(data)
+    if name == 'truncate':
+        return spec, lambda: build_truncate(data, int(parts[1]))
+    if name == 'project':
+        return spec, lambda: build_project(data, int(parts[1]))
+    if name == 'ivf':
+        nlist = int(np.sqrt(len(data))) if parts[1] == 'auto' else int(parts[1])
+        nprobe = int(parts[2])
+        return f"ivf:{nlist}:{nprobe}", lambda: build_ivf(data, nlist, nprobe)
+    raise ValueError(f"Unknown search config: {spec}")
+
+
+def recall_at_k(truth: np.ndarray, found: np.ndarray) -> Optional[float]:
+    truth = truth[truth >= 0]
+    if len(truth) == 0:
+        return None
+    return len(np.intersect1d(truth, found)) / len(truth)
+
+
+def rank_correlation(found: np.ndarray, query_unit: np.ndarray, data_unit: np.ndarray) -> Optional[float]:
+    """
+    Spearman 秩相关: 返回列表中的顺序 vs 这些项目在精确相似度下的顺序
+    衡量近似检索对其返回项目的排序是否忠实
+    """
+    if len(found) < 2:
+        return None
+    exact_scores = data_unit[found] @ query_unit
+    approx_rank = np.arange(len(found), dtype=np.float64)
+    exact_rank = np.argsort(np.argsort(-exact_scores, kind='stable')).astype(np.float64)
+    return float(np.corrcoef(approx_rank, exact_rank)[0, 1])
+
+
+def evaluate(name: str, builder: Callable, queries: np.ndarray, k: int, mask: Optional[np.ndarray],
+             truth: np.ndarray, queries_unit: np.ndarray, data_unit: np.ndarray) -> Dict:
+    start = time.perf_counter()
+    search, stored_bytes = builder()
+    build_ms = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    recalls = []
+    correlations = []
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        found = search(query, k, mask)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        recall = recall_at_k(truth[i], found)
+        if recall is not None:
+            recalls.append(recall)
+        correlation = rank_correlation(found, queries_unit[i], data_unit)
+        if correlation is not None:
+            correlations.append(correlation)
+
+    return {
+        'config': name,
+        'recall': float(np.mean(recalls)) if recalls else float('nan'),
+        'rank_corr': float(np.mean(correlations)) if correlations else float('nan'),
+        'latency_ms': float(np.mean(latencies)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'build_ms': build_ms,
+        'stored_kb': stored_bytes / 1024
+    }
+
+
+def mark_pareto(results: List[Dict]) -> None:
+    """
+    标记 recall 越高越好、平均延迟越低越好意义下的非支配配置
+    recall 为 NaN (过滤后没有任何满足条件的项目) 的配置不参与比较，也不标记
+    """
+    scored = [r for r in results if not np.isnan(r['recall'])]
+    for r in results:
+        r['pareto'] = not np.isnan(r['recall']) and not any(
+            o['recall'] >= r['recall'] and o['latency_ms'] <= r['latency_ms']
+            and (o['recall'] > r['recall'] or o['latency_ms'] < r['latency_ms'])
+            for o in scored
+        )
+
+
+def print_table(filter_spec: str, k: int, results: List[Dict]) -> None:
+    print(f"\n📊 过滤条件: {filter_spec} | recall@{k}")
+    print("-" * 96)
+    print(f"{'config':<18}{'recall':>9}{'rank_corr':>11}{'mean_ms':>10}{'p95_ms':>10}{'build_ms':>11}{'stored_kb':>11}  pareto")
+    for r in sorted(results, key=lambda r: (-r['recall'], r['latency_ms'])):
+        print(f"{r['config']:<18}{r['recall']:>9.4f}{r['rank_corr']:>11.4f}{r['latency_ms']:>10.3f}"
+              f"{r['p95_ms']:>10.3f}{r['build_ms']:>11.1f}{r['stored_kb']:>11.1f}  {'★' if r['pareto'] else ''}")
+
+
+# 主函数
+def main():
+    parser = argparse.ArgumentParser(description="评估近似/压缩检索配置相对精确余弦检索的召回率与延迟")
+    parser.add_argument('--source', choices=['catalog', 'synthetic'], default='catalog',
+                        help="catalog: 从向量存储加载真实目录; synthetic: 生成合成向量")
+    parser.add_argument('--size', type=int, default=5000, help="合成目录大小")
+    parser.add_argument('--dim', type=int, default=1536, help="合成向量维度")
+    parser.add_argument('--queries', type=int, default=200, help="查询数量")
+    parser.add_argument('--query-file', help="查询向量 .npy 文件，覆盖 --queries")
+    parser.add_argument('--noise', type=float, default=1.0, help="生成查询时的噪声强度")
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--configs', nargs='+', default=DEFAULT_CONFIGS)
+    parser.add_argument('--filters', nargs='+', default=DEFAULT_FILTERS)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--cache-dir', default='.eval_cache')
+    parser.add_argument('--output', help="结果写入 CSV 文件")
+    args = parser.parse_args()
+
+    print("🧪 检索配置评估")
+    print("=" * 60)
+
+    if args.source == 'catalog':
+        data, metadata = load_catalog()
+    else:
+        data, metadata = load_synthetic(args.size, args.dim, args.seed)
+
+    if args.query_file:
+        queries = np.load(args.query_file).astype(np.float32)
+    else:
+        queries = make_queries(data, args.queries, args.noise, args.seed)
+    print(f"✅ 查询数量: {len(queries)}")
+
+    configs = [parse_config(spec, data) for spec in args.configs]
+    all_results = []
+
+    # 精确相似度的参照向量只归一化一次，所有过滤条件共用
+    data_unit = normalize(data.astype(np.float64))
+    queries_unit = normalize(queries.astype(np.float64))
+
+    for filter_spec in args.filters:
+        mask = parse_filter(filter_spec, metadata)
+        truth = exact_ground_truth(data_unit, queries_unit, args.k, mask, filter_spec, args.cache_dir)
+
+        results = []
+        for name, builder in configs:
+            print(f"🔄 评估 {name} ({filter_spec})...")
+            results.append(evaluate(name, builder, queries, args.k, mask, truth, queries_unit, data_unit))
+
+        mark_pareto(results)
+        print_table(filter_spec, args.k, results)
+        for r in results:
+            r['filter'] = filter_spec
+        all_results.extend(results)
+
+    if args.output:
+        fields = ['filter', 'config', 'recall', 'rank_corr', 'latency_ms', 'p95_ms', 'build_ms', 'stored_kb', 'pareto']
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(all_results)
+        print(f"\n✅ 结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
 import openai
-import pymysql
 import json
+import heapq
 import numpy as np
+import pymysql.cursors
 from dotenv import load_dotenv
 import os
 from typing import List, Dict, Tuple
+from vector_store import TiDBVectorStore, get_db_connection, get_vector_store
 
 # 加载环境变量
 load_dotenv('../.env')
@@ -12,17 +14,6 @@ load_dotenv('../.env')
 # 配置
 client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
-# 数据库连接
-def get_db_connection():
-    return pymysql.connect(
-        host=os.getenv('TIDB_HOST'),
-        port=int(os.getenv('TIDB_PORT', 4000)),
-        user=os.getenv('TIDB_USER'),
-        password=os.getenv('TIDB_PASSWORD'),
-        database=os.getenv('TIDB_DATABASE'),
-        charset='utf8mb4',
-        ssl={'check_hostname': False, 'verify_mode': 0}
-    )
 
 # 计算余弦相似度
 def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
@@ -51,8 +42,136 @@ def vectorize_student_profile(student_info: str) -> List[float]:
     
     return response.data[0].embedding
 
+_tidb_metadata_store = None
+
+# 展示元数据的来源
+def get_metadata_store() -> TiDBVectorStore:
+    """
+    本模块的排序直接读取 TiDB 的 details_vector，展示字段也必须来自同一个 TiDB，
+    否则 id 会对应到另一份目录。默认后端即 TiDB 时复用 get_vector_store() 的实例与缓存
+    """
+    global _tidb_metadata_store
+    if os.getenv('VECTOR_STORE_BACKEND', 'tidb') == 'tidb':
+        return get_vector_store()
+    if _tidb_metadata_store is None:
+        _tidb_metadata_store = TiDBVectorStore()
+    return _tidb_metadata_store
+
+# 补全展示字段并格式化匹配结果
+def hydrate_matches(scored: List[Tuple[int, float]]) -> List[Dict]:
+    """
+    为 (id, 相似度) 列表批量查询展示元数据并组装为匹配结果
+    program_details 已在数据库端截断
+    """
+    metadata = get_metadata_store().get_school_metadata([school_id for school_id, _ in scored])
+    
+    matches = []
+    for school_id, similarity in scored:
+        if school_id not in metadata:
+            continue
+        school = metadata[school_id]
+        matches.append({
+            'id': school_id,
+            'school_name': school['school_name'],
+            'program_name': school['program_name'],
+            'country': school['country_region'],
+            'ranking': school['qs_ranking'],
+            'field': school['specific_field'],
+            'degree_type': school['degree_type'],
+            'duration': school['duration'],
+            'similarity_score': similarity,
+            'program_details': school['program_details']
+        })
+    return matches
+
+# 流式匹配 - 服务端游标分块读取 + 大小为k的堆
+def match_schools_streaming(student_vector: List[float], top_k: int = 10,
+                            country_filter: str = None, chunk_size: int = 500) -> List[Dict]:
+    """
+    使用无缓冲的服务端游标按块读取学校项目，逐块向量化计算相似度，
+    只保留相似度最高的top_k个，峰值内存为 O(top_k + chunk_size)
+    
+    Args:
+        student_vector: 学生信息向量
+        top_k: 返回前k个匹配结果
+        country_filter: 国家过滤器 (可选)
+        chunk_size: 每次从游标读取的行数
+    
+    Returns:
+        按相似度降序排列的匹配结果列表
+    """
+    if top_k <= 0:
+        return []
+    
+    query = np.asarray(student_vector, dtype=np.float64)
+    query_norm = np.linalg.norm(query)
+    
+    # 排序阶段只读取id与向量
+    sql = """
+        SELECT id, details_vector
+        FROM schools 
+        WHERE details_vector IS NOT NULL
+    """
+    params = []
+    if country_filter:
+        sql += " AND country_region = %s"
+        params.append(country_filter)
+        print(f"🔍 应用国家过滤器: {country_filter}")
+    
+    # 最小堆: (相似度, -序号, id)，堆顶为当前第k名；
+    # 相似度相同时先淘汰较晚读到的行，与非流式路径的稳定排序一致
+    heap = []
+    scanned = 0
+    
+    conn = get_db_connection()
+    try:
+        with conn.cursor(pymysql.cursors.SSCursor) as cursor:
+            cursor.execute(sql, params)
+            
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                
+                # 解析向量，跳过无法解析的行
+                valid_ids = []
+                vectors = []
+                for school_id, vector_json in rows:
+                    try:
+                        vector = json.loads(vector_json)
+                        if len(vector) != len(query):
+                            raise ValueError(f"向量维度 {len(vector)} 与查询维度 {len(query)} 不一致")
+                        vectors.append(vector)
+                        valid_ids.append(school_id)
+                    except Exception as e:
+                        print(f"❌ 解析项目向量时出错 (id={school_id}): {e}")
+                
+                if vectors:
+                    # 向量化计算整块余弦相似度
+                    matrix = np.asarray(vectors, dtype=np.float64)
+                    norms = np.linalg.norm(matrix, axis=1) * query_norm
+                    dots = matrix @ query
+                    scores = np.divide(dots, norms, out=np.zeros_like(dots), where=norms != 0)
+                    
+                    for school_id, score in zip(valid_ids, scores.tolist()):
+                        item = (score, -scanned, school_id)
+                        scanned += 1
+                        if len(heap) < top_k:
+                            heapq.heappush(heap, item)
+                        elif score > heap[0][0]:
+                            heapq.heapreplace(heap, item)
+                
+                print(f"📊 已扫描 {scanned} 个项目")
+    finally:
+        conn.close()
+    
+    print(f"✅ 流式匹配完成，共扫描 {scanned} 个项目")
+    best = sorted(heap, key=lambda item: (-item[0], -item[1]))
+    return hydrate_matches([(school_id, score) for score, _, school_id in best])
+
 # 匹配学校项目
-def match_schools(student_info: str, top_k: int = 10, country_filter: str = None) -> List[Dict]:
+def match_schools(student_info: str, top_k: int = 10, country_filter: str = None,
+                  stream: bool = False, chunk_size: int = 500) -> List[Dict]:
     """
     根据学生信息匹配最适合的学校项目
     
@@ -60,16 +179,24 @@ def match_schools(student_info: str, top_k: int = 10, country_filter: str = None
         student_info: 学生背景信息描述
         top_k: 返回前k个匹配结果
         country_filter: 国家过滤器 (可选)
+        stream: 是否使用流式匹配，适用于无法一次性载入内存的大目录
+        chunk_size: 流式匹配时每块读取的行数
     
     Returns:
         匹配结果列表
     """
+    if top_k <= 0:
+        return []
     
     # 1. 向量化学生信息
     print("🔄 步骤1: 开始向量化学生信息...")
     student_vector = vectorize_student_profile(student_info)
     print(f"✅ 学生信息向量化完成，维度: {len(student_vector)}")
     
+    if stream:
+        print("🔄 步骤2: 流式读取并匹配学校项目...")
+        return match_schools_streaming(student_vector, top_k, country_filter, chunk_size)
+    
     # 2. 从数据库获取所有学校项目
     print("🔄 步骤2: 连接数据库...")
     conn = get_db_connection()
@@ -78,21 +205,21 @@ def match_schools(student_info: str, top_k: int = 10, country_filter: str = None
     try:
         print("🔄 步骤3: 查询学校项目数据...")
         with conn.cursor() as cursor:
-            # 构建查询SQL
+            # 构建查询SQL，排序阶段只读取id与向量
             sql = """
-                SELECT id, school_name, program_name, country_region, 
-                       qs_ranking, specific_field, degree_type, duration,
-                       program_details, details_vector
+                SELECT id, details_vector
                 FROM schools 
                 WHERE details_vector IS NOT NULL
             """
             
+            params = []
             if country_filter:
-                sql += f" AND country_region = '{country_filter}'"
+                sql += " AND country_region = %s"
+                params.append(country_filter)
                 print(f"🔍 应用国家过滤器: {country_filter}")
             
             print("🔄 执行SQL查询...")
-            cursor.execute(sql)
+            cursor.execute(sql, params)
             print("🔄 获取查询结果...")
             schools = cursor.fetchall()
             
@@ -114,40 +241,29 @@ def match_schools(student_info: str, top_k: int = 10, country_filter: str = None
         if i % 50 == 0:  # 每处理50个显示进度
             print(f"📊 进度: {i}/{total_schools} ({i/total_schools*100:.1f}%)")
         
+        school_id, vector_json = school
         try:
-            school_id, school_name, program_name, country, ranking, field, degree, duration, details, vector_json = school
-            
             # 解析向量
             school_vector = json.loads(vector_json)
             
             # 计算相似度
             similarity = cosine_similarity(student_vector, school_vector)
             
-            matches.append({
-                'id': school_id,
-                'school_name': school_name,
-                'program_name': program_name,
-                'country': country,
-                'ranking': ranking,
-                'field': field,
-                'degree_type': degree,
-                'duration': duration,
-                'similarity_score': similarity,
-                'program_details': details[:200] + '...' if len(details) > 200 else details
-            })
+            matches.append((school_id, similarity))
             
         except Exception as e:
-            print(f"❌ 处理第{i}个项目时出错 ({school_name if 'school_name' in locals() else 'unknown'}): {e}")
+            print(f"❌ 处理第{i}个项目时出错 (id={school_id}): {e}")
             continue
     
     print(f"✅ 相似度计算完成，共处理 {len(matches)} 个项目")
     
     # 4. 按相似度排序
     print("🔄 步骤5: 排序结果...")
-    matches.sort(key=lambda x: x['similarity_score'], reverse=True)
+    matches.sort(key=lambda x: x[1], reverse=True)
     print(f"✅ 排序完成，返回前 {top_k} 个结果")
     
-    return matches[:top_k]
+    # 5. 仅为前top_k个结果补全展示字段
+    return hydrate_matches(matches[:top_k])
 
 # 主函数
 def main():
@@ -1,8 +1,8 @@
 import openai
-import pymysql
 from dotenv import load_dotenv
 import os
 from typing import List, Dict
+from vector_store import get_vector_store
 
 # 加载环境变量
 load_dotenv('../.env')
@@ -10,18 +10,6 @@ load_dotenv('../.env')
 # 配置
 client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
-# 数据库连接
-def get_db_connection():
-    return pymysql.connect(
-        host=os.getenv('TIDB_HOST'),
-        port=int(os.getenv('TIDB_PORT', 4000)),
-        user=os.getenv('TIDB_USER'),
-        password=os.getenv('TIDB_PASSWORD'),
-        database=os.getenv('TIDB_DATABASE'),
-        charset='utf8mb4',
-        ssl={'check_hostname': False, 'verify_mode': 0}
-    )
-
 # 学生信息向量化
 def vectorize_student_profile(student_info: str) -> List[float]:
     """将学生信息向量化"""
@@ -34,10 +22,10 @@ def vectorize_student_profile(student_info: str) -> List[float]:
     
     return response.data[0].embedding
 
-# 优化版匹配学校项目 - 使用原生SQL向量搜索
+# 优化版匹配学校项目 - 使用存储后端的原生向量搜索
 def match_schools_optimized(student_info: str, top_k: int = 10, country_filter: str = None, ranking_limit: int = None) -> List[Dict]:
     """
-    使用TiDB原生向量搜索匹配最适合的学校项目
+    使用向量存储后端 (TiDB 或本地 SQLite) 的向量搜索匹配最适合的学校项目
     
     Args:
         student_info: 学生背景信息描述
@@ -54,65 +42,39 @@ def match_schools_optimized(student_info: str, top_k: int = 10, country_filter:
     student_vector = vectorize_student_profile(student_info)
     print(f"✅ 向量化完成，维度: {len(student_vector)}")
     
-    # 2. 使用原生SQL向量搜索
+    # 2. 使用原生向量搜索
     print("🔄 步骤2: 执行向量搜索...")
-    conn = get_db_connection()
+    if country_filter:
+        print(f"🔍 应用国家过滤器: {country_filter}")
+    if ranking_limit:
+        print(f"🔍 应用排名限制: 前{ranking_limit}名")
     
-    try:
-        with conn.cursor() as cursor:
-            # 构建SQL查询
-            sql = """
-                SELECT 
-                    id, school_name, program_name, country_region, 
-                    qs_ranking, specific_field, degree_type, duration,
-                    program_details,
-                    VEC_COSINE_DISTANCE(embedding, %s) AS similarity_score
-                FROM schools 
-                WHERE 1=1
-            """
-            
-            params = [str(student_vector)]
-            
-            # 添加过滤条件
-            if country_filter:
-                sql += " AND country_region = %s"
-                params.append(country_filter)
-                print(f"🔍 应用国家过滤器: {country_filter}")
-            
-            if ranking_limit:
-                sql += " AND qs_ranking <= %s"
-                params.append(ranking_limit)
-                print(f"🔍 应用排名限制: 前{ranking_limit}名")
-            
-            # 按相似度排序并限制结果数量
-            sql += " ORDER BY similarity_score ASC LIMIT %s"
-            params.append(top_k)
-            
-            print("🔄 执行数据库查询...")
-            cursor.execute(sql, params)
-            results = cursor.fetchall()
-            
-            print(f"✅ 查询完成，找到 {len(results)} 个匹配项目")
-            
-    finally:
-        conn.close()
+    print("🔄 执行数据库查询...")
+    results = get_vector_store().search_schools(
+        student_vector,
+        top_k=top_k,
+        country_filter=country_filter,
+        ranking_limit=ranking_limit
+    )
+    print(f"✅ 查询完成，找到 {len(results)} 个匹配项目")
+    
+    # 3. 仅为top_k结果批量补全展示字段 (详情已在数据库端截断)
+    results = get_vector_store().hydrate_schools(results)
     
-    # 3. 格式化结果
+    # 4. 格式化结果
     matches = []
     for result in results:
-        id_val, school_name, program_name, country, ranking, field, degree, duration, details, similarity_score = result
-        
         matches.append({
-            'id': id_val,
-            'school_name': school_name,
-            'program_name': program_name,
-            'country': country,
-            'ranking': ranking,
-            'field': field,
-            'degree_type': degree,
-            'duration': duration,
-            'similarity_score': similarity_score,
-            'program_details': details[:200] + '...' if len(details) > 200 else details
+            'id': result['id'],
+            'school_name': result['school_name'],
+            'program_name': result['program_name'],
+            'country': result['country_region'],
+            'ranking': result['qs_ranking'],
+            'field': result['specific_field'],
+            'degree_type': result['degree_type'],
+            'duration': result['duration'],
+            'similarity_score': result['distance'],
+            'program_details': result['program_details']
         })
     
     print("✅ 结果格式化完成")
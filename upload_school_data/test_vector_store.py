@@ -0,0 +1,282 @@
+import json
+import os
+import sqlite3
+import types
+
+import numpy as np
+import pytest
+
+# match_schools 在导入时创建 OpenAI 客户端，测试中不会发起请求
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+
+import api_demo
+import match_schools
+from match_schools import cosine_similarity
+import vector_store
+from vector_store import SQLiteVectorStore
+
+COUNTRIES = ['United States', 'United Kingdom', 'Canada']
+
+
+@pytest.fixture
+def catalog():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(60, 16)).astype(np.float32)
+    store = SQLiteVectorStore(':memory:')
+    schools = []
+    for i, vector in enumerate(vectors):
+        school = {
+            'id': i,
+            'school_name': f"School {i}",
+            'program_name': "MSc Computer Science",
+            'country_region': COUNTRIES[i % len(COUNTRIES)],
+            'qs_ranking': i + 1,
+            'program_details': "details",
+        }
+        store.insert_school(school, vector.tolist())
+        schools.append(school)
+    return store, schools, vectors, rng
+
+
+@pytest.mark.parametrize("country_filter, ranking_limit", [
+    (None, None),
+    ('United Kingdom', None),
+    (None, 20),
+    ('Canada', 30),
+])
+def test_filtered_top_k_matches_cosine_similarity(catalog, country_filter, ranking_limit):
+    store, schools, vectors, rng = catalog
+    query = rng.normal(size=16).astype(np.float32).tolist()
+
+    expected = sorted(
+        (
+            (cosine_similarity(query, vectors[s['id']]), s['id']) for s in schools
+            if (not country_filter or s['country_region'] == country_filter)
+            and (not ranking_limit or s['qs_ranking'] <= ranking_limit)
+        ),
+        reverse=True
+    )[:5]
+
+    results = store.search_schools(query, top_k=5, country_filter=country_filter, ranking_limit=ranking_limit)
+
+    assert [r['id'] for r in results] == [school_id for _, school_id in expected]
+    for r, (similarity, _) in zip(results, expected):
+        assert r['distance'] == pytest.approx(1 - similarity, abs=1e-5)
+
+
+def test_insert_duplicate_id_raises(catalog):
+    store, schools, vectors, _ = catalog
+    with pytest.raises(sqlite3.IntegrityError):
+        store.insert_school(schools[0], vectors[0].tolist())
+
+
+def test_session_crud():
+    store = SQLiteVectorStore(':memory:')
+    store.create_session('s1', '[]', "profile", [0.5, -0.25], 'analyzed')
+
+    assert store.get_profile_embedding('s1') == [0.5, -0.25]
+    assert store.get_profile_embedding('missing') is None
+
+    store.update_session('s1', profile_embedding=[1.0, 0.0], status='completed', timeline_data='{}')
+    assert store.get_profile_embedding('s1') == [1.0, 0.0]
+    assert store._execute("SELECT status, timeline_data FROM user_sessions WHERE session_id = %s", ('s1',)) == [('completed', '{}')]
+
+    with pytest.raises(ValueError):
+        store.update_session('s1', user_id='u1')
+
+    store._execute("UPDATE user_sessions SET profile_embedding = NULL WHERE session_id = %s", ('s1',))
+    assert store.get_profile_embedding('s1') is None
+
+
+def test_hydrate_truncates_details_and_caches(catalog):
+    store, _, vectors, _ = catalog
+    store.insert_school({'id': 100, 'school_name': "Long", 'program_details': 'x' * 500}, vectors[0].tolist())
+
+    results = store.hydrate_schools([{'id': 100, 'distance': 0.1}, {'id': 999, 'distance': 0.2}])
+    assert len(results) == 1
+    assert results[0]['school_name'] == "Long"
+    assert results[0]['program_details'] == 'x' * 200 + '...'
+    assert results[0]['distance'] == 0.1
+
+    # 缓存命中时不再查询数据库
+    store._fetch_school_metadata = None
+    assert store.get_school_metadata([100])[100]['school_name'] == "Long"
+
+
+def test_metadata_cache_ttl_and_size(catalog, monkeypatch):
+    store, _, _, _ = catalog
+    fetched = []
+    fetch = store._fetch_school_metadata
+    store._fetch_school_metadata = lambda ids: fetched.extend(ids) or fetch(ids)
+
+    monkeypatch.setattr(vector_store, 'METADATA_CACHE_SIZE', 2)
+    store.get_school_metadata([1, 2, 3])
+    assert list(store._metadata_cache) == [2, 3]
+
+    monkeypatch.setattr(vector_store, 'METADATA_CACHE_TTL', 0)
+    store.get_school_metadata([3])
+    assert fetched == [1, 2, 3, 3]
+
+
+def test_metadata_cache_accessed_under_lock(catalog, monkeypatch):
+    store, _, vectors, _ = catalog
+    monkeypatch.setattr(vector_store, 'METADATA_CACHE_SIZE', 2)
+
+    class CheckedCache(vector_store.OrderedDict):
+        """每次读写缓存时断言 _cache_lock 已被持有"""
+
+    for name in ('get', 'move_to_end', '__setitem__', 'popitem', 'pop', 'clear'):
+        def checked(self, *args, _method=getattr(vector_store.OrderedDict, name), **kwargs):
+            assert store._cache_lock.locked()
+            return _method(self, *args, **kwargs)
+        setattr(CheckedCache, name, checked)
+
+    # 数据库查询不应持有缓存锁
+    fetch = store._fetch_school_metadata
+    store._fetch_school_metadata = lambda ids: (not store._cache_lock.locked()) and fetch(ids)
+    store._metadata_cache = CheckedCache()
+
+    store.get_school_metadata([1, 2, 3])
+    store.get_school_metadata([3, 1])
+    store.insert_school({'id': 100}, vectors[0].tolist())
+    store.clear_schools()
+    assert not store._cache_lock.locked()
+
+
+class FakeCursor:
+    """模拟 pymysql 游标: fetchmany 按块返回，fetchall 一次返回全部"""
+
+    def __init__(self, rows, fetches):
+        self.rows = rows
+        self.fetches = fetches
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.position = 0
+
+    def fetchmany(self, size):
+        chunk = self.rows[self.position:self.position + size]
+        self.position += len(chunk)
+        self.fetches.append(len(chunk))
+        return chunk
+
+    def fetchall(self):
+        return self.fetchmany(len(self.rows))
+
+
+@pytest.fixture
+def school_rows(catalog, monkeypatch):
+    """
+    将目录向量作为 details_vector 行按 id 倒序返回 (查询向量为 id 0):
+    id 59/58/57 向量相同、并列且最先读到，id 1/2 与查询同向、最后读到，
+    id 20 维度错误
+    """
+    store, _, vectors, _ = catalog
+    query = vectors[0]
+    rows = [(i, json.dumps(vector.tolist())) for i, vector in enumerate(vectors)]
+    tied = json.dumps((query + vectors[3]).tolist())
+    for school_id in (59, 58, 57):
+        rows[school_id] = (school_id, tied)
+    for school_id in (1, 2):
+        rows[school_id] = (school_id, json.dumps((query * (school_id + 1)).tolist()))
+    rows[20] = (20, json.dumps(vectors[20][:8].tolist()))
+    rows.reverse()
+
+    fetches = []
+    conn = types.SimpleNamespace(cursor=lambda *args: FakeCursor(rows, fetches), close=lambda: None)
+    monkeypatch.setattr(match_schools, 'get_db_connection', lambda: conn)
+    monkeypatch.setattr(match_schools, 'get_metadata_store', lambda: store)
+    monkeypatch.setattr(match_schools, 'vectorize_student_profile', lambda info: query.tolist())
+    return fetches
+
+
+@pytest.mark.parametrize("top_k", [1, 4, 5, 60])
+def test_streaming_matches_non_streaming(school_rows, top_k):
+    expected = match_schools.match_schools("student", top_k=top_k)
+    streamed = match_schools.match_schools("student", top_k=top_k, stream=True, chunk_size=7)
+
+    assert [m['id'] for m in streamed] == [m['id'] for m in expected]
+    assert [m['similarity_score'] for m in streamed] == pytest.approx([m['similarity_score'] for m in expected])
+    assert 20 not in [m['id'] for m in streamed]
+    assert school_rows[1:] == [7] * 8 + [4, 0]
+
+
+def test_streaming_keeps_earliest_of_tied_rows(school_rows):
+    # 并列行先填满堆，后读到的 id 0/1/2 依次淘汰堆顶，应保留最早读到的 id 59
+    streamed = match_schools.match_schools("student", top_k=4, stream=True, chunk_size=7)
+    assert [m['id'] for m in streamed][3:] == [59]
+
+
+@pytest.mark.parametrize("top_k", [0, -1])
+def test_non_positive_top_k_returns_nothing(school_rows, top_k):
+    assert match_schools.match_schools_streaming([1.0] * 16, top_k=top_k) == []
+    assert match_schools.match_schools("student", top_k=top_k) == []
+    assert match_schools.match_schools("student", top_k=top_k, stream=True) == []
+    assert school_rows == []
+
+
+@pytest.fixture
+def embedding_calls(monkeypatch):
+    """桩 client.embeddings.create: 向量为 [文本长度, 1]，记录每次请求的输入"""
+    calls = []
+
+    def create(input, model):
+        calls.append(list(input))
+        return types.SimpleNamespace(data=[
+            types.SimpleNamespace(index=i, embedding=[float(len(text)), 1.0]) for i, text in enumerate(input)
+        ])
+
+    monkeypatch.setattr(api_demo, 'client', types.SimpleNamespace(embeddings=types.SimpleNamespace(create=create)))
+    monkeypatch.setattr(api_demo, '_embedding_cache', api_demo.OrderedDict())
+    return calls
+
+
+def test_embed_texts_batches_and_caches(embedding_calls):
+    assert api_demo.embed_texts(['ab', 'c', 'ab']) == [[2.0, 1.0], [1.0, 1.0], [2.0, 1.0]]
+    assert embedding_calls == [['ab', 'c']]
+
+    # 新一轮对话只为新消息付费
+    api_demo.build_profile_embedding(['ab', 'c', 'def'], 'recency')
+    assert embedding_calls[-1] == ['def']
+
+
+def test_embed_texts_lru_bound(embedding_calls, monkeypatch):
+    monkeypatch.setattr(api_demo, 'EMBEDDING_CACHE_SIZE', 2)
+    api_demo.embed_texts(['a', 'b', 'c'])
+    assert len(api_demo._embedding_cache) == 2
+
+    api_demo.embed_texts(['c', 'a'])
+    assert embedding_calls[-1] == ['a']
+
+
+def test_full_strategy_reembeds_profile_and_falls_back(embedding_calls, monkeypatch):
+    monkeypatch.setattr(api_demo, 'PROFILE_FULL_MAX_CHARS', 5)
+
+    # full 策略每轮都对拼接后的整段档案重新付费
+    api_demo.build_profile_embedding(['ab'], 'full')
+    api_demo.build_profile_embedding(['ab', 'cd'], 'full')
+    assert embedding_calls == [['ab'], ['ab cd']]
+
+    # 超出长度上限时回退到 recency，只向量化新消息
+    api_demo.build_profile_embedding(['ab', 'cd', 'ef'], 'full')
+    assert embedding_calls[-1] == ['cd', 'ef']
+
+
+def test_recency_weights(embedding_calls, monkeypatch):
+    monkeypatch.setattr(api_demo, 'PROFILE_RECENCY_DECAY', 0.5)
+    vector = api_demo.build_profile_embedding(['a', 'bbb'], 'recency')
+
+    # 权重 0.5 与 1 -> 未归一化均值 [(0.5*1 + 3) / 1.5, 1]
+    expected = np.array([3.5 / 1.5, 1.0])
+    assert vector == pytest.approx((expected / np.linalg.norm(expected)).tolist())
+
+
+def test_unknown_strategy_rejected_before_embedding(embedding_calls):
+    with pytest.raises(ValueError):
+        api_demo.build_profile_embedding(['a'], 'recnecy')
+    assert embedding_calls == []
@@ -1,9 +1,8 @@
 import pandas as pd
 import openai
-import pymysql
 import os
 from dotenv import load_dotenv
-import json
+from vector_store import get_vector_store, SCHOOL_COLUMNS
 
 # 加载环境变量 (从项目根目录)
 load_dotenv('../.env')
@@ -11,24 +10,14 @@ load_dotenv('../.env')
 # 配置
 client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
-# 数据库连接
-conn = pymysql.connect(
-    host=os.getenv('TIDB_HOST'),
-    port=int(os.getenv('TIDB_PORT', 4000)),
-    user=os.getenv('TIDB_USER'),
-    password=os.getenv('TIDB_PASSWORD'),
-    database=os.getenv('TIDB_DATABASE'),
-    charset='utf8mb4',
-    ssl={'check_hostname': False, 'verify_mode': 0}
-)
+# 存储后端 (VECTOR_STORE_BACKEND=tidb / sqlite)
+store = get_vector_store()
 
-print("Connected to TiDB successfully")
+print(f"Connected to {type(store).__name__} successfully")
 
 # 清空现有数据
 print("Clearing existing data...")
-with conn.cursor() as cursor:
-    cursor.execute("DELETE FROM schools")
-    conn.commit()
+store.clear_schools()
 print("✓ Existing data cleared")
 
 # 读取CSV文件
@@ -52,41 +41,13 @@ for index, row in df.iterrows():
         embedding_vector = embedding_response.data[0].embedding
         
         # 插入数据库
-        with conn.cursor() as cursor:
-            sql = """
-                INSERT INTO schools (
-                    id, school_name, qs_ranking, country_region, broad_category, 
-                    specific_field, program_name, program_url, graduate_school_url, 
-                    degree_type, duration, crawl_status, language_requirements, 
-                    program_details, embedding
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            
-            cursor.execute(sql, (
-                row['id'],
-                row['school_name'],
-                row['qs_ranking'],
-                row['country_region'],
-                row['broad_category'],
-                row['specific_field'],
-                row['program_name'],
-                row['program_url'],
-                row['graduate_school_url'],
-                row['degree_type'],
-                row['duration'],
-                row['crawl_status'],
-                row['language_requirements'],
-                row['program_details'],
-                str(embedding_vector)  # 直接存储为VECTOR类型
-            ))
+        store.insert_school({column: row[column] for column in SCHOOL_COLUMNS}, embedding_vector)
         
-        conn.commit()
         print(f"✓ Successfully processed: {row['school_name']} - {row['program_name']}")
         
     except Exception as e:
         print(f"✗ Error processing record {index + 1}: {e}")
-        conn.rollback()
         continue
 
-conn.close()
+store.close()
 print("Upload completed!")
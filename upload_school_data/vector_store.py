@@ -0,0 +1,439 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+import pymysql
+
+# schools 表中的列 (不含向量)
+SCHOOL_COLUMNS = [
+    'id', 'school_name', 'qs_ranking', 'country_region', 'broad_category',
+    'specific_field', 'program_name', 'program_url', 'graduate_school_url',
+    'degree_type', 'duration', 'crawl_status', 'language_requirements',
+    'program_details'
+]
+
+# 展示用的元数据列，program_details 只返回前 DETAILS_PREVIEW_LENGTH 个字符
+METADATA_COLUMNS = [
+    'id', 'school_name', 'program_name', 'country_region', 'qs_ranking',
+    'specific_field', 'degree_type', 'duration', 'program_details'
+]
+DETAILS_PREVIEW_LENGTH = 200
+
+# 元数据缓存 (LRU + TTL)，见 VectorStore.get_school_metadata
+METADATA_CACHE_SIZE = int(os.getenv('METADATA_CACHE_SIZE', 5000))
+METADATA_CACHE_TTL = float(os.getenv('METADATA_CACHE_TTL', 300))
+
+# user_sessions 表中允许更新的列
+SESSION_COLUMNS = [
+    'chat_messages', 'user_profile', 'profile_embedding', 'status',
+    'target_schools', 'reach_schools', 'timeline_data'
+]
+
+
+# 数据库连接
+def get_db_connection():
+    return pymysql.connect(
+        host=os.getenv('TIDB_HOST'),
+        port=int(os.getenv('TIDB_PORT', 4000)),
+        user=os.getenv('TIDB_USER'),
+        password=os.getenv('TIDB_PASSWORD'),
+        database=os.getenv('TIDB_DATABASE'),
+        charset='utf8mb4',
+        ssl={'check_hostname': False, 'verify_mode': 0}
+    )
+
+
+def _check_session_fields(fields: Dict) -> None:
+    unknown = set(fields) - set(SESSION_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown session fields: {sorted(unknown)}")
+
+
+def _build_search_sql(country_filter: str, ranking_limit: int, top_k: int) -> Tuple[str, List]:
+    # TiDB 与 SQLite 共用: SQLite 中 VEC_COSINE_DISTANCE 为注册的自定义函数
+    sql = """
+        SELECT id, VEC_COSINE_DISTANCE(embedding, %s) AS distance
+        FROM schools
+        WHERE embedding IS NOT NULL
+    """
+    params = []
+
+    if country_filter:
+        sql += " AND country_region = %s"
+        params.append(country_filter)
+
+    if ranking_limit:
+        sql += " AND qs_ranking <= %s"
+        params.append(ranking_limit)
+
+    sql += " ORDER BY distance ASC LIMIT %s"
+    params.append(top_k)
+    return sql, params
+
+
+def _build_metadata_sql(ids: List[int], preview_expr: str, length_expr: str) -> str:
+    # 在数据库端截断 program_details，避免传输全文
+    columns = [c for c in METADATA_COLUMNS if c != 'program_details']
+    return f"""
+        SELECT {', '.join(columns)},
+               {preview_expr} AS details_preview,
+               {length_expr} AS details_length
+        FROM schools
+        WHERE id IN ({', '.join(['%s'] * len(ids))})
+    """
+
+
+def _metadata_from_row(row: Tuple) -> Dict:
+    *values, preview, length = row
+    metadata = dict(zip([c for c in METADATA_COLUMNS if c != 'program_details'], values))
+    preview = preview or ''
+    metadata['program_details'] = preview + '...' if (length or 0) > DETAILS_PREVIEW_LENGTH else preview
+    return metadata
+
+
+class VectorStore(ABC):
+    """
+    学校目录与用户会话的存储接口
+    TiDB 与本地 SQLite 后端共用同一套 %s 占位符 SQL，后端只需提供
+    _execute、向量编解码 (_encode_vector/_decode_vector) 和方言相关的 SQL 表达式
+
+    向量搜索只返回 id 与距离；展示字段通过 get_school_metadata
+    对最终 top-k 批量查询，并按 id 缓存在内存中
+    """
+
+    # 截取 program_details 前 DETAILS_PREVIEW_LENGTH 个字符及计算其长度的 SQL 表达式
+    DETAILS_PREVIEW_SQL: str
+    DETAILS_LENGTH_SQL: str
+
+    def __init__(self):
+        # id -> (写入时间, 元数据)
+        self._metadata_cache: "OrderedDict[int, Tuple[float, Dict]]" = OrderedDict()
+        # 缓存在线程间共享 (get 与 move_to_end 之间条目可能被淘汰)，读写都在锁内进行；
+        # 数据库查询在锁外执行
+        self._cache_lock = threading.Lock()
+
+    def close(self) -> None:
+        """释放后端持有的连接"""
+
+    @abstractmethod
+    def _execute(self, sql: str, params=None) -> List:
+        """执行一条语句并提交，返回全部结果行"""
+
+    @abstractmethod
+    def _encode_vector(self, vector: List[float]):
+        """向量 -> 数据库中的存储值"""
+
+    @abstractmethod
+    def _decode_vector(self, value) -> List[float]:
+        """数据库中的存储值 -> 向量"""
+
+    def _encode_value(self, value):
+        """写入普通列前的转换，默认原样写入"""
+        return value
+
+    def clear_schools(self) -> None:
+        """清空学校目录"""
+        self._execute("DELETE FROM schools")
+        with self._cache_lock:
+            self._metadata_cache.clear()
+
+    def insert_school(self, school: Dict, embedding: List[float]) -> None:
+        """插入一个学校项目及其向量，id 已存在时报错 (两个后端语义一致)"""
+        columns = SCHOOL_COLUMNS + ['embedding']
+        sql = f"""
+            INSERT INTO schools ({', '.join(columns)})
+            VALUES ({', '.join(['%s'] * len(columns))})
+        """
+        values = [self._encode_value(school.get(column)) for column in SCHOOL_COLUMNS]
+        values.append(self._encode_vector(embedding))
+        self._execute(sql, values)
+        with self._cache_lock:
+            self._metadata_cache.pop(values[0], None)
+
+    def search_schools(self, vector: List[float], top_k: int = 10,
+                       country_filter: str = None, ranking_limit: int = None) -> List[Dict]:
+        """
+        向量 top-k 搜索，只读取 id 与距离
+
+        Returns:
+            按余弦距离升序排列的 [{'id', 'distance'}]
+        """
+        sql, params = _build_search_sql(country_filter, ranking_limit, top_k)
+        rows = self._execute(sql, [self._encode_vector(vector)] + params)
+        return [{'id': row[0], 'distance': row[1]} for row in rows]
+
+    def _fetch_school_metadata(self, ids: List[int]) -> List[Dict]:
+        """批量查询展示元数据，每项包含 METADATA_COLUMNS"""
+        sql = _build_metadata_sql(ids, self.DETAILS_PREVIEW_SQL, self.DETAILS_LENGTH_SQL)
+        return [_metadata_from_row(row) for row in self._execute(sql, list(ids))]
+
+    def get_school_metadata(self, ids: List[int]) -> Dict[int, Dict]:
+        """
+        获取学校项目的展示元数据，未缓存的 id 合并为一次批量查询
+
+        缓存只在当前进程内有效: 本进程的 insert_school/clear_schools 会使其失效，
+        其他进程 (如 upload.py 重新导入目录) 的修改最迟在 METADATA_CACHE_TTL 秒后生效。
+        缓存最多保留 METADATA_CACHE_SIZE 条，超出时淘汰最久未使用的条目
+
+        Returns:
+            id -> 元数据，不存在的 id 不包含在结果中
+        """
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self._cache_lock:
+            for school_id in dict.fromkeys(ids):
+                cached = self._metadata_cache.get(school_id)
+                if cached and now - cached[0] < METADATA_CACHE_TTL:
+                    self._metadata_cache.move_to_end(school_id)
+                    found[school_id] = cached[1]
+                else:
+                    missing.append(school_id)
+
+        if missing:
+            rows = self._fetch_school_metadata(missing)
+            with self._cache_lock:
+                for row in rows:
+                    found[row['id']] = row
+                    self._metadata_cache[row['id']] = (now, row)
+                    self._metadata_cache.move_to_end(row['id'])
+                while len(self._metadata_cache) > METADATA_CACHE_SIZE:
+                    self._metadata_cache.popitem(last=False)
+
+        return {school_id: found[school_id] for school_id in ids if school_id in found}
+
+    def hydrate_schools(self, results: List[Dict]) -> List[Dict]:
+        """为搜索结果补全展示元数据，保持原有顺序"""
+        metadata = self.get_school_metadata([r['id'] for r in results])
+        return [{**metadata[r['id']], **r} for r in results if r['id'] in metadata]
+
+    def load_catalog_embeddings(self) -> List[Dict]:
+        """
+        导出整个目录的向量，用于离线评估
+
+        Returns:
+            每项包含 id, country_region, qs_ranking, embedding
+        """
+        rows = self._execute("""
+            SELECT id, country_region, qs_ranking, embedding
+            FROM schools
+            WHERE embedding IS NOT NULL
+            ORDER BY id
+        """)
+        return [
+            {'id': row[0], 'country_region': row[1], 'qs_ranking': row[2], 'embedding': self._decode_vector(row[3])}
+            for row in rows
+        ]
+
+    def create_session(self, session_id: str, chat_messages: str, user_profile: str,
+                       profile_embedding: List[float], status: str) -> None:
+        """创建用户会话"""
+        self._execute("""
+            INSERT INTO user_sessions (
+                session_id, chat_messages, user_profile,
+                profile_embedding, status
+            ) VALUES (%s, %s, %s, %s, %s)
+        """, (session_id, chat_messages, user_profile, self._encode_vector(profile_embedding), status))
+
+    def get_profile_embedding(self, session_id: str) -> Optional[List[float]]:
+        """获取会话的档案向量，会话不存在时返回 None"""
+        rows = self._execute("""
+            SELECT profile_embedding FROM user_sessions
+            WHERE session_id = %s
+        """, (session_id,))
+        if not rows or rows[0][0] is None:
+            return None
+        return self._decode_vector(rows[0][0])
+
+    def update_session(self, session_id: str, **fields) -> None:
+        """更新会话字段，字段名必须在 SESSION_COLUMNS 中"""
+        _check_session_fields(fields)
+        if 'profile_embedding' in fields:
+            fields['profile_embedding'] = self._encode_vector(fields['profile_embedding'])
+        assignments = ', '.join(f"{column} = %s" for column in fields)
+        self._execute(
+            f"UPDATE user_sessions SET {assignments} WHERE session_id = %s",
+            list(fields.values()) + [session_id]
+        )
+
+
+class TiDBVectorStore(VectorStore):
+    """
+    基于 TiDB 原生向量搜索的存储后端
+    保持一个持久连接，首次使用时建立；空闲超过 CONNECTION_PING_INTERVAL 秒后
+    先 ping(reconnect=True) 再执行，断线时自动重连
+    """
+
+    DETAILS_PREVIEW_SQL = f"LEFT(program_details, {DETAILS_PREVIEW_LENGTH})"
+    DETAILS_LENGTH_SQL = "CHAR_LENGTH(program_details)"
+    CONNECTION_PING_INTERVAL = 30
+
+    def __init__(self):
+        super().__init__()
+        self._conn = None
+        self._last_used = 0.0
+        # pymysql 连接不是线程安全的，语句通过 _lock 串行执行
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        now = time.monotonic()
+        if self._conn is None or not self._conn.open:
+            self._conn = get_db_connection()
+        elif now - self._last_used > self.CONNECTION_PING_INTERVAL:
+            self._conn.ping(reconnect=True)
+        self._last_used = now
+        return self._conn
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None and self._conn.open:
+                self._conn.close()
+            self._conn = None
+
+    def _execute(self, sql: str, params=None) -> List:
+        with self._lock:
+            conn = self._connection()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(sql, params)
+                    rows = cursor.fetchall()
+                conn.commit()
+            except Exception:
+                if conn.open:
+                    conn.rollback()
+                raise
+        return rows
+
+    def _encode_vector(self, vector: List[float]) -> str:
+        return str(vector)  # 直接存储为VECTOR类型
+
+    def _decode_vector(self, value: str) -> List[float]:
+        return json.loads(value)
+
+
+# SQLite 中向量以 float32 二进制存储
+def vector_to_blob(vector: List[float]) -> bytes:
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def blob_to_vector(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype=np.float32)
+
+
+def _sqlite_cosine_distance(blob1: bytes, blob2: bytes) -> Optional[float]:
+    """注册到 SQLite 的 VEC_COSINE_DISTANCE，语义与 TiDB 一致"""
+    if blob1 is None or blob2 is None:
+        return None
+    vec1 = blob_to_vector(blob1)
+    vec2 = blob_to_vector(blob2)
+
+    norm = float(np.linalg.norm(vec1) * np.linalg.norm(vec2))
+    if norm == 0:
+        return 1.0
+    return 1.0 - float(np.dot(vec1, vec2)) / norm
+
+
+class SQLiteVectorStore(VectorStore):
+    """
+    嵌入式本地后端: SQLite + 注册的余弦距离函数
+    适用于单机部署、边缘节点和离线测试
+    """
+
+    DETAILS_PREVIEW_SQL = f"substr(program_details, 1, {DETAILS_PREVIEW_LENGTH})"
+    DETAILS_LENGTH_SQL = "length(program_details)"
+
+    def __init__(self, path: str = None):
+        super().__init__()
+        self.path = path or os.getenv('SQLITE_PATH', 'edupath.db')
+        # 保持单个连接，':memory:' 数据库在连接关闭后即丢失
+        # 连接在线程间共享，所有语句通过 _lock 串行执行
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.create_function('VEC_COSINE_DISTANCE', 2, _sqlite_cosine_distance, deterministic=True)
+        self._create_tables()
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+    def _create_tables(self) -> None:
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS schools (
+                id INTEGER PRIMARY KEY,
+                school_name TEXT,
+                qs_ranking INTEGER,
+                country_region TEXT,
+                broad_category TEXT,
+                specific_field TEXT,
+                program_name TEXT,
+                program_url TEXT,
+                graduate_school_url TEXT,
+                degree_type TEXT,
+                duration TEXT,
+                crawl_status TEXT,
+                language_requirements TEXT,
+                program_details TEXT,
+                embedding BLOB
+            );
+            CREATE INDEX IF NOT EXISTS idx_schools_country ON schools (country_region);
+            CREATE INDEX IF NOT EXISTS idx_schools_ranking ON schools (qs_ranking);
+            CREATE TABLE IF NOT EXISTS user_sessions (
+                session_id TEXT PRIMARY KEY,
+                chat_messages TEXT,
+                user_profile TEXT,
+                profile_embedding BLOB,
+                status TEXT,
+                target_schools TEXT,
+                reach_schools TEXT,
+                timeline_data TEXT
+            );
+        """)
+        self.conn.commit()
+
+    def _execute(self, sql: str, params=()) -> List:
+        # 与 pymysql 共用 %s 占位符写法
+        with self._lock:
+            try:
+                cursor = self.conn.execute(sql.replace('%s', '?'), params)
+                rows = cursor.fetchall()
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        return rows
+
+    def _encode_vector(self, vector: List[float]) -> bytes:
+        return vector_to_blob(vector)
+
+    def _decode_vector(self, value: bytes) -> List[float]:
+        return blob_to_vector(value).tolist()
+
+    def _encode_value(self, value):
+        # pandas 行中的 numpy 标量需转换为 Python 原生类型
+        return value.item() if isinstance(value, np.generic) else value
+
+
+_store: Optional[VectorStore] = None
+
+
+def get_vector_store() -> VectorStore:
+    """
+    根据 VECTOR_STORE_BACKEND 环境变量返回存储后端 (tidb / sqlite)
+    同一进程内复用同一个实例
+    """
+    global _store
+    if _store is None:
+        backend = os.getenv('VECTOR_STORE_BACKEND', 'tidb')
+        if backend == 'tidb':
+            _store = TiDBVectorStore()
+        elif backend == 'sqlite':
+            _store = SQLiteVectorStore()
+        else:
+            raise ValueError(f"Unknown vector store backend: {backend}")
+    return _store